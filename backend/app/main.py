@@ -1,13 +1,16 @@
 """FastAPI application main file."""
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import init_db
+from fastapi.responses import ORJSONResponse
+from app.database import SessionLocal, init_db
+from app.ml.inference import model_cache_stats
 from app.routers import datasets, training, evaluation, inference
 
 app = FastAPI(
     title="LLM Fine-tuning Platform",
     description="Platform for fine-tuning and evaluating LLMs",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -28,8 +31,19 @@ app.include_router(inference.router)
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup."""
-    init_db()
+    """Initialize database and recover training jobs on startup."""
+    await init_db()
+    async with SessionLocal() as db:
+        await training.task_registry.bootstrap(db)
+    # Inference batchers keyed by model (training job) id, created on first use
+    app.state.batchers = {}
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop inference batch workers."""
+    for batcher in app.state.batchers.values():
+        batcher.close()
 
 
 @app.get("/")
@@ -45,5 +59,5 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check endpoint."""
-    return {"status": "healthy"}
+    return {"status": "healthy", "model_cache": model_cache_stats()}
 
@@ -1,16 +1,233 @@
 """Dataset validation logic."""
-import json
+import hashlib
 import os
-from typing import Dict, List, Any
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from typing import Deque, Dict, Iterable, List, Any, Tuple, Union
+import numpy as np
+import orjson
 import tiktoken
+from app.ml.jsonl import map_file, line_spans
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the numpy version below runs uncompiled
+    def njit(*args, **kwargs):
+        return lambda func: func
 
-def validate_dataset(file_path: str) -> Dict[str, Any]:
+
+# Below this many lines per worker, splitting the file costs more than it saves
+MIN_LINES_PER_CHUNK = 2000
+
+# Streamed chunks being validated at once per stream; the next chunk is only read
+# once the oldest finishes
+STREAM_CHUNKS_IN_FLIGHT = os.cpu_count() or 1
+
+# Workers for streamed chunks, shared by every stream rather than started per upload
+_chunk_executor = ThreadPoolExecutor(
+    max_workers=STREAM_CHUNKS_IN_FLIGHT,
+    thread_name_prefix="dataset-chunk"
+)
+
+# encode_ordinary_batch starts a thread pool per call; smaller inputs are encoded inline
+MIN_TEXTS_PER_BATCH_ENCODE = 64
+
+# Token length limits for prompts and completions
+MIN_TOKENS = 10
+MAX_TOKENS = 2048
+
+# ASCII texts in this character range sit inside the token limits, so the ~4
+# chars/token estimate is used instead of tokenizing. Every BPE token is at least
+# one byte, so ASCII text can't have more tokens than characters; other scripts
+# (e.g. CJK, often a token or more per character) are always tokenized.
+FAST_PATH_MIN_CHARS = 80
+FAST_PATH_MAX_CHARS = MAX_TOKENS
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer used for length estimation once per process."""
+    try:
+        return tiktoken.get_encoding("cl100k_base")  # GPT-4 tokenizer
+    except Exception:
+        return None
+
+
+def _example_hash(prompt: str, completion: str) -> int:
+    """Return a 64-bit, case-insensitive fingerprint of an example for duplicate detection."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(prompt.strip().lower().encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(completion.strip().lower().encode("utf-8"))
+    return int.from_bytes(digest.digest(), "little")
+
+
+def _token_lengths(encoding, texts: List[str], num_threads: int) -> np.ndarray:
+    """
+    Count tokens per text, skipping tiktoken's special-token scan.
+    
+    Only non-ASCII texts and texts near the length thresholds are tokenized
+    exactly; the rest (and everything, if no encoding is available) use
+    character count / 4.
+    """
+    lengths = np.fromiter((len(text) // 4 for text in texts), dtype=np.int32, count=len(texts))
+    if encoding is None:
+        return lengths
+    
+    ambiguous = [
+        i for i, text in enumerate(texts)
+        if not (text.isascii() and FAST_PATH_MIN_CHARS <= len(text) <= FAST_PATH_MAX_CHARS)
+    ]
+    ambiguous_texts = [texts[i] for i in ambiguous]
+    if num_threads <= 1 or len(ambiguous_texts) < MIN_TEXTS_PER_BATCH_ENCODE:
+        encoded = [encoding.encode_ordinary(text) for text in ambiguous_texts]
+    else:
+        encoded = encoding.encode_ordinary_batch(ambiguous_texts, num_threads=num_threads)
+    
+    for i, tokens in zip(ambiguous, encoded):
+        lengths[i] = len(tokens)
+    return lengths
+
+
+@njit(cache=True)
+def _scan_lengths(lengths: np.ndarray, lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the indices of lengths below lo and above hi."""
+    return np.nonzero(lengths < lo)[0], np.nonzero(lengths > hi)[0]
+
+
+def _validate_chunk(lines: Iterable[bytes], first_line_num: int, num_threads: int) -> Dict[str, Any]:
+    """
+    Parse, tokenize and length-check a contiguous block of JSONL lines.
+    
+    Duplicates can span chunks, so example hashes are returned in line order
+    for the caller to check against the whole file.
+    """
+    issues = []
+    line_numbers = []
+    prompts = []
+    completions = []
+    hashes = []
+    
+    for line_num, line in enumerate(lines, first_line_num):
+        line = line.strip()
+        if not line:
+            continue
+        
+        try:
+            example = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            issues.append((line_num, f"Line {line_num}: Invalid JSON - {str(e)}"))
+            continue
+        
+        # Check required fields
+        if "prompt" not in example or "completion" not in example:
+            issues.append((line_num, f"Line {line_num}: Missing 'prompt' or 'completion' field"))
+            continue
+        
+        prompt = str(example["prompt"])
+        completion = str(example["completion"])
+        
+        # Check for empty fields
+        if not prompt.strip():
+            issues.append((line_num, f"Line {line_num}: Empty prompt"))
+            continue
+        
+        if not completion.strip():
+            issues.append((line_num, f"Line {line_num}: Empty completion"))
+            continue
+        
+        line_numbers.append(line_num)
+        prompts.append(prompt)
+        completions.append(completion)
+        hashes.append((line_num, _example_hash(prompt, completion)))
+    
+    # Calculate token lengths
+    encoding = _get_encoding()
+    prompt_lengths = _token_lengths(encoding, prompts, num_threads)
+    completion_lengths = _token_lengths(encoding, completions, num_threads)
+    
+    # Emitted check by check; the caller's stable sort by line restores per-line order
+    prompt_short, prompt_long = _scan_lengths(prompt_lengths, MIN_TOKENS, MAX_TOKENS)
+    completion_short, completion_long = _scan_lengths(completion_lengths, MIN_TOKENS, MAX_TOKENS)
+    
+    # Check for very short examples
+    for i in prompt_short:
+        issues.append((line_numbers[i], f"Line {line_numbers[i]}: Prompt too short ({prompt_lengths[i]} tokens)"))
+    
+    for i in completion_short:
+        issues.append((line_numbers[i], f"Line {line_numbers[i]}: Completion too short ({completion_lengths[i]} tokens)"))
+    
+    # Check for very long examples
+    for i in prompt_long:
+        issues.append((line_numbers[i], f"Line {line_numbers[i]}: Prompt too long ({prompt_lengths[i]} tokens, max {MAX_TOKENS})"))
+    
+    for i in completion_long:
+        issues.append((line_numbers[i], f"Line {line_numbers[i]}: Completion too long ({completion_lengths[i]} tokens, max {MAX_TOKENS})"))
+    
+    return {
+        "num_examples": len(line_numbers),
+        "issues": issues,
+        "prompt_lengths": prompt_lengths,
+        "completion_lengths": completion_lengths,
+        "hashes": hashes,
+    }
+
+
+def _validate_file(file_path: str) -> List[Dict[str, Any]]:
+    """Split a JSONL file into line-aligned chunks and validate them in parallel."""
+    with map_file(file_path) as mm:
+        starts, ends = line_spans(mm)
+        
+        cpu_count = os.cpu_count() or 1
+        num_chunks = max(1, min(cpu_count, len(starts) // MIN_LINES_PER_CHUNK))
+        # Share the cores between chunk workers and tiktoken's own batch threads
+        num_threads = max(1, cpu_count // num_chunks)
+        bounds = np.linspace(0, len(starts), num_chunks + 1).astype(np.int64)
+        
+        def run_chunk(lo: int, hi: int) -> Dict[str, Any]:
+            lines = (mm[start:end] for start, end in zip(starts[lo:hi], ends[lo:hi]))
+            return _validate_chunk(lines, lo + 1, num_threads)
+        
+        if num_chunks == 1:
+            return [run_chunk(0, len(starts))]
+        
+        with ThreadPoolExecutor(max_workers=num_chunks) as executor:
+            futures = [
+                executor.submit(run_chunk, int(lo), int(hi))
+                for lo, hi in zip(bounds[:-1], bounds[1:])
+            ]
+            return [future.result() for future in futures]
+
+
+def _validate_lines(lines: Iterable[bytes]) -> List[Dict[str, Any]]:
+    """
+    Validate a stream of JSONL lines, handing each full chunk to a worker as it arrives.
+    
+    At most one chunk per worker is pulled ahead, so a producer feeding `lines`
+    from a bounded queue is held back rather than buffered in memory.
+    """
+    lines = iter(lines)
+    results = []
+    pending: Deque[Future] = deque()
+    first_line_num = 1
+    while chunk := list(islice(lines, MIN_LINES_PER_CHUNK)):
+        if len(pending) >= STREAM_CHUNKS_IN_FLIGHT:
+            results.append(pending.popleft().result())
+        pending.append(_chunk_executor.submit(_validate_chunk, chunk, first_line_num, 1))
+        first_line_num += len(chunk)
+    results.extend(future.result() for future in pending)
+    return results
+
+
+def validate_dataset(source: Union[str, Iterable[bytes]]) -> Dict[str, Any]:
     """
     Validate training data and return statistics.
     
     Args:
-        file_path: Path to JSONL file
+        source: Path to JSONL file, or an iterable of its lines as bytes
         
     Returns:
         {
@@ -24,95 +241,44 @@ def validate_dataset(file_path: str) -> Dict[str, Any]:
     """
     issues = []
     recommendations = []
-    examples = []
+    num_examples = 0
+    # Per-chunk int32 token counts, concatenated once at the end
     prompt_lengths = []
     completion_lengths = []
-    seen_examples = set()
-    
-    # Initialize tokenizer for length estimation
-    try:
-        encoding = tiktoken.get_encoding("cl100k_base")  # GPT-4 tokenizer
-    except:
-        encoding = None
+    seen_hashes = set()
     
-    if not os.path.exists(file_path):
+    if isinstance(source, str) and not os.path.exists(source):
         return {
             "valid": False,
             "num_examples": 0,
             "avg_prompt_length": 0.0,
             "avg_completion_length": 0.0,
-            "issues": [f"File not found: {file_path}"],
+            "issues": [f"File not found: {source}"],
             "recommendations": []
         }
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                
-                try:
-                    example = json.loads(line)
-                except json.JSONDecodeError as e:
-                    issues.append(f"Line {line_num}: Invalid JSON - {str(e)}")
-                    continue
-                
-                # Check required fields
-                if "prompt" not in example or "completion" not in example:
-                    issues.append(f"Line {line_num}: Missing 'prompt' or 'completion' field")
-                    continue
-                
-                prompt = str(example["prompt"])
-                completion = str(example["completion"])
-                
-                # Check for empty fields
-                if not prompt.strip():
-                    issues.append(f"Line {line_num}: Empty prompt")
-                    continue
-                
-                if not completion.strip():
-                    issues.append(f"Line {line_num}: Empty completion")
-                    continue
-                
-                # Calculate token lengths
-                if encoding:
-                    prompt_tokens = len(encoding.encode(prompt))
-                    completion_tokens = len(encoding.encode(completion))
-                else:
-                    # Fallback to character count / 4 (rough estimate)
-                    prompt_tokens = len(prompt) // 4
-                    completion_tokens = len(completion) // 4
-                
-                prompt_lengths.append(prompt_tokens)
-                completion_lengths.append(completion_tokens)
-                
-                # Check for very short examples
-                if prompt_tokens < 10:
-                    issues.append(f"Line {line_num}: Prompt too short ({prompt_tokens} tokens)")
-                
-                if completion_tokens < 10:
-                    issues.append(f"Line {line_num}: Completion too short ({completion_tokens} tokens)")
-                
-                # Check for very long examples
-                if prompt_tokens > 2048:
-                    issues.append(f"Line {line_num}: Prompt too long ({prompt_tokens} tokens, max 2048)")
-                
-                if completion_tokens > 2048:
-                    issues.append(f"Line {line_num}: Completion too long ({completion_tokens} tokens, max 2048)")
-                
-                # Check for duplicates
-                example_key = (prompt.lower().strip(), completion.lower().strip())
-                if example_key in seen_examples:
-                    issues.append(f"Line {line_num}: Duplicate example")
+        results = _validate_file(source) if isinstance(source, str) else _validate_lines(source)
+        
+        # Merge chunk results in file order
+        for result in results:
+            num_examples += result["num_examples"]
+            issues.extend(result["issues"])
+            prompt_lengths.append(result["prompt_lengths"])
+            completion_lengths.append(result["completion_lengths"])
+            
+            # Check for duplicates
+            for line_num, example_hash in result["hashes"]:
+                if example_hash in seen_hashes:
+                    issues.append((line_num, f"Line {line_num}: Duplicate example"))
                 else:
-                    seen_examples.add(example_key)
-                
-                examples.append(example)
+                    seen_hashes.add(example_hash)
+        
+        # Report issues in line order
+        issues = [message for _, message in sorted(issues, key=itemgetter(0))]
         
-        num_examples = len(examples)
-        avg_prompt_length = sum(prompt_lengths) / num_examples if num_examples > 0 else 0.0
-        avg_completion_length = sum(completion_lengths) / num_examples if num_examples > 0 else 0.0
+        avg_prompt_length = float(np.concatenate(prompt_lengths).mean()) if num_examples > 0 else 0.0
+        avg_completion_length = float(np.concatenate(completion_lengths).mean()) if num_examples > 0 else 0.0
         
         # Generate recommendations
         if num_examples < 50:
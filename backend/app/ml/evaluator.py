@@ -1,19 +1,50 @@
 """Model evaluation and comparison logic."""
-import json
 import asyncio
-from typing import Dict, Any, List
-from app.ml.inference import generate_text
+import os
+from typing import Dict, Any, List, Optional
+import orjson
+from app.ml.inference import USE_VLLM, Quantization, generate_batch
+from app.ml.jsonl import tail_lines
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Prompts sent to each model per generate call
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "8"))
+
+
+async def _generate_or_errors(
+    label: str,
+    model_path: str,
+    prompts: List[str],
+    base_model_name: Optional[str] = None,
+    quantization: Quantization = "none"
+) -> List[Dict[str, Any]]:
+    """Generate a batch off the event loop, reporting a failure as an error output per prompt."""
+    try:
+        return await asyncio.to_thread(
+            generate_batch,
+            model_path,
+            prompts,
+            max_tokens=256,
+            base_model_name=base_model_name,
+            quantization=quantization
+        )
+    except Exception as e:
+        logger.error(f"{label} model error: {str(e)}")
+        return [
+            {"output": f"Error: {str(e)}", "latency_ms": 0, "tokens_used": 0}
+            for _ in prompts
+        ]
+
 
 async def evaluate_models(
     dataset_path: str,
     base_model_name: str,
     finetuned_model_path: str,
-    test_size: int = 50
+    test_size: int = 50,
+    quantization: Quantization = "none"
 ) -> Dict[str, Any]:
     """
     Compare base model vs fine-tuned model.
@@ -23,26 +54,25 @@ async def evaluate_models(
         base_model_name: Name of base model
         finetuned_model_path: Path to fine-tuned model
         test_size: Number of test examples to use
+        quantization: Weight-only quantization for both models ("none", "int8" or "nf4")
         
     Returns:
         Dictionary with test_results and metrics
     """
-    # Load test examples
+    # Load test examples (last test_size lines are the test set)
     test_examples = []
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        # Use last test_size examples as test set
-        test_lines = lines[-test_size:] if len(lines) > test_size else lines
-        
-        for line in test_lines:
-            line = line.strip()
-            if not line:
-                continue
-            example = json.loads(line)
-            test_examples.append(example)
+    for line in tail_lines(dataset_path, test_size):
+        line = line.strip()
+        if not line:
+            continue
+        example = orjson.loads(line)
+        test_examples.append(example)
     
     logger.info(f"Evaluating on {len(test_examples)} test examples")
     
+    prompts = [example.get("prompt", "") for example in test_examples]
+    prompts = [prompt for prompt in prompts if prompt]
+    
     # Run inference on both models
     test_results = []
     base_latencies = []
@@ -50,64 +80,45 @@ async def evaluate_models(
     base_lengths = []
     finetuned_lengths = []
     
-    for i, example in enumerate(test_examples):
-        prompt = example.get("prompt", "")
-        
-        if not prompt:
-            continue
-        
-        logger.info(f"Processing example {i+1}/{len(test_examples)}")
+    # vLLM does its own continuous batching, so it gets every prompt at once
+    batch_size = max(len(prompts), 1) if USE_VLLM else EVAL_BATCH_SIZE
+    
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start:start + batch_size]
+        logger.info(f"Processing examples {start+1}-{start+len(batch)}/{len(prompts)}")
         
         # Run base model
-        try:
-            base_result = generate_text(
-                base_model_name,
-                prompt,
-                max_tokens=256
-            )
-            base_output = base_result["output"]
-            base_latency = base_result["latency_ms"]
-            base_tokens = base_result["tokens_used"]
-        except Exception as e:
-            logger.error(f"Base model error: {str(e)}")
-            base_output = f"Error: {str(e)}"
-            base_latency = 0
-            base_tokens = 0
+        base_results = await _generate_or_errors(
+            "Base",
+            base_model_name,
+            batch,
+            quantization=quantization
+        )
         
         # Run fine-tuned model
-        try:
-            finetuned_result = generate_text(
-                finetuned_model_path,
-                prompt,
-                max_tokens=256,
-                base_model_name=base_model_name
-            )
-            finetuned_output = finetuned_result["output"]
-            finetuned_latency = finetuned_result["latency_ms"]
-            finetuned_tokens = finetuned_result["tokens_used"]
-        except Exception as e:
-            logger.error(f"Fine-tuned model error: {str(e)}")
-            finetuned_output = f"Error: {str(e)}"
-            finetuned_latency = 0
-            finetuned_tokens = 0
-        
-        test_results.append({
-            "prompt": prompt,
-            "base_output": base_output,
-            "finetuned_output": finetuned_output,
-            "base_latency_ms": base_latency,
-            "finetuned_latency_ms": finetuned_latency,
-            "base_tokens": base_tokens,
-            "finetuned_tokens": finetuned_tokens,
-        })
-        
-        base_latencies.append(base_latency)
-        finetuned_latencies.append(finetuned_latency)
-        base_lengths.append(base_tokens)
-        finetuned_lengths.append(finetuned_tokens)
+        finetuned_results = await _generate_or_errors(
+            "Fine-tuned",
+            finetuned_model_path,
+            batch,
+            base_model_name=base_model_name,
+            quantization=quantization
+        )
         
-        # Small delay to avoid overwhelming the system
-        await asyncio.sleep(0.1)
+        for prompt, base_result, finetuned_result in zip(batch, base_results, finetuned_results):
+            test_results.append({
+                "prompt": prompt,
+                "base_output": base_result["output"],
+                "finetuned_output": finetuned_result["output"],
+                "base_latency_ms": base_result["latency_ms"],
+                "finetuned_latency_ms": finetuned_result["latency_ms"],
+                "base_tokens": base_result["tokens_used"],
+                "finetuned_tokens": finetuned_result["tokens_used"],
+            })
+            
+            base_latencies.append(base_result["latency_ms"])
+            finetuned_latencies.append(finetuned_result["latency_ms"])
+            base_lengths.append(base_result["tokens_used"])
+            finetuned_lengths.append(finetuned_result["tokens_used"])
     
     # Calculate metrics
     avg_base_latency = sum(base_latencies) / len(base_latencies) if base_latencies else 0
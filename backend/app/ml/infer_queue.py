@@ -0,0 +1,90 @@
+"""Micro-batching of concurrent inference requests."""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.ml.inference import generate_batch
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Most prompts generated together in one call
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+# How long the first request in a batch waits for others to join it
+INFERENCE_MAX_DELAY_MS = float(os.getenv("INFERENCE_MAX_DELAY_MS", "10"))
+
+
+class InferenceBatcher:
+    """
+    Coalesce concurrent requests for one model into batched generate calls.
+    
+    Requests arriving within INFERENCE_MAX_DELAY_MS of each other share a
+    generate_batch call, up to INFERENCE_MAX_BATCH prompts per call.
+    """
+    
+    def __init__(self, model_path: str, base_model_name: Optional[str] = None):
+        self.model_path = model_path
+        self.base_model_name = base_model_name
+        self._queue: "asyncio.Queue[Tuple[str, int, asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """Queue a prompt and wait for its result (output, latency_ms, tokens_used)."""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, max_tokens, future))
+        return await future
+    
+    def close(self) -> None:
+        """Stop the worker; requests still queued are left unanswered."""
+        if self._worker is not None:
+            self._worker.cancel()
+    
+    async def _next_batch(self) -> List[Tuple[str, int, asyncio.Future]]:
+        """Wait for a request, then collect whatever else arrives within the delay."""
+        batch = [await self._queue.get()]
+        await asyncio.sleep(INFERENCE_MAX_DELAY_MS / 1000)
+        while len(batch) < INFERENCE_MAX_BATCH and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+    
+    async def _run(self) -> None:
+        """Generate queued requests batch by batch and hand each result to its caller."""
+        while True:
+            batch = await self._next_batch()
+            
+            # generate_batch takes a single max_tokens, so split the batch by it
+            groups: Dict[int, List[Tuple[str, int, asyncio.Future]]] = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            
+            for max_tokens, items in groups.items():
+                prompts = [prompt for prompt, _, _ in items]
+                start_time = time.time()
+                try:
+                    results = await asyncio.to_thread(
+                        generate_batch,
+                        self.model_path,
+                        prompts,
+                        max_tokens,
+                        self.base_model_name
+                    )
+                    # generate_batch splits the batch time across prompts, but every
+                    # caller waited for the whole batch
+                    latency_ms = int((time.time() - start_time) * 1000)
+                    results = [{**result, "latency_ms": latency_ms} for result in results]
+                except Exception as e:
+                    logger.error(f"Batched generation error: {str(e)}")
+                    results = [e] * len(items)
+                
+                for (_, _, future), result in zip(items, results):
+                    # The caller may have disconnected and cancelled its future
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
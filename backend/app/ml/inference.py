@@ -1,38 +1,198 @@
 """Inference logic for running models."""
+import gc
 import os
+import threading
+from collections import OrderedDict
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers.utils import is_flash_attn_2_available
 from peft import PeftModel
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Literal, Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Cache for loaded models
-_model_cache: Dict[str, Any] = {}
-_tokenizer_cache: Dict[str, Any] = {}
+# Device, dtype and attention kernel are resolved once, not per load/generate call
+_DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+if _DEVICE.type != "cuda":
+    _DTYPE = torch.float32
+elif torch.cuda.get_device_capability()[0] >= 8:
+    # bf16 has fp16's bandwidth without its narrow exponent range, but needs Ampere+
+    _DTYPE = torch.bfloat16
+else:
+    _DTYPE = torch.float16
 
+# FlashAttention-2 needs a compatible flash_attn build and an Ampere+ GPU
+if (
+    _DEVICE.type == "cuda"
+    and is_flash_attn_2_available()
+    and torch.cuda.get_device_capability()[0] >= 8
+):
+    _ATTN_IMPLEMENTATION = "flash_attention_2"
+else:
+    _ATTN_IMPLEMENTATION = "sdpa"
 
-def load_model(model_path: str, base_model_name: Optional[str] = None) -> tuple:
+# Weight-only quantization applied when loading a model for inference
+Quantization = Literal["none", "int8", "nf4"]
+
+# Most models kept loaded at once; the least recently used one is evicted first.
+# At least one, so the model just loaded is never evicted before it is used.
+MODEL_CACHE_SIZE = max(1, int(os.getenv("MODEL_CACHE_SIZE", "2")))
+
+# LRU cache of (model, tokenizer) keyed by (base_model_name, model_path, quantization)
+_model_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+# Per-key locks so concurrent requests for an uncached model load it only once
+_model_load_locks: Dict[tuple, threading.Lock] = {}
+_model_cache_evictions = 0
+
+# Serve generation from vLLM (paged KV cache, continuous batching) instead of
+# transformers. Needs a GPU and the optional vllm package; CPU hosts keep using HF.
+USE_VLLM = os.getenv("USE_VLLM", "false").lower() in ("1", "true", "yes") and _DEVICE.type == "cuda"
+
+# vLLM engines keyed by the model they serve. Fine-tuned LoRA checkpoints share
+# their base model's engine and are applied per request. Each engine reserves
+# most of the GPU's memory up front, so only one base model is served per process.
+MAX_VLLM_ENGINES = 1
+_vllm_engines: Dict[str, Any] = {}
+_vllm_lora_ids: Dict[str, int] = {}
+_vllm_lock = threading.Lock()
+
+
+def _model_load_kwargs(quantization: Quantization = "none") -> Dict[str, Any]:
+    """Keyword arguments for AutoModelForCausalLM.from_pretrained on this machine."""
+    if _DEVICE.type != "cuda":
+        if quantization != "none":
+            logger.warning(f"Ignoring {quantization} quantization: bitsandbytes requires CUDA")
+        return {"torch_dtype": _DTYPE, "device_map": None}
+    
+    kwargs = {"torch_dtype": _DTYPE, "device_map": "auto"}
+    if quantization == "int8":
+        kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+    elif quantization == "nf4":
+        kwargs["quantization_config"] = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=_DTYPE,
+        )
+    return kwargs
+
+
+def _from_pretrained(name_or_path: str, quantization: Quantization):
+    """Load a causal LM with the preferred attention kernel, if its architecture has one."""
+    kwargs = _model_load_kwargs(quantization)
+    try:
+        return AutoModelForCausalLM.from_pretrained(
+            name_or_path,
+            attn_implementation=_ATTN_IMPLEMENTATION,
+            **kwargs,
+        )
+    except (ValueError, ImportError) as e:
+        # Architectures without SDPA / FlashAttention-2 support, or a flash_attn
+        # install transformers can't use, reject the request before any weights
+        # load; the default still picks SDPA where it is supported
+        logger.warning(
+            f"{_ATTN_IMPLEMENTATION} attention unavailable for {name_or_path}, using the default: {e}"
+        )
+        return AutoModelForCausalLM.from_pretrained(name_or_path, **kwargs)
+
+
+def _free_unused_memory() -> None:
+    """Collect unreferenced models and return cached GPU blocks to the driver."""
+    gc.collect()
+    if _DEVICE.type == "cuda":
+        torch.cuda.empty_cache()
+
+
+def _evict_models(keep: int) -> None:
+    """Evict least recently used models until at most `keep` remain cached."""
+    global _model_cache_evictions
+    
+    while True:
+        with _model_cache_lock:
+            if len(_model_cache) <= keep:
+                return
+            cache_key, entry = _model_cache.popitem(last=False)
+            _model_cache_evictions += 1
+        
+        logger.info(f"Evicting cached model: {cache_key}")
+        # Drop this frame's reference before collecting, or the weights outlive
+        # empty_cache. Requests still generating with the model keep it alive
+        # until they finish.
+        del entry
+        _free_unused_memory()
+
+
+def model_cache_stats() -> Dict[str, Any]:
+    """Report model cache occupancy and evictions for monitoring."""
+    with _model_cache_lock:
+        return {
+            "cached_models": len(_model_cache),
+            "capacity": MODEL_CACHE_SIZE,
+            "evictions": _model_cache_evictions,
+        }
+
+
+def load_model(
+    model_path: str,
+    base_model_name: Optional[str] = None,
+    quantization: Quantization = "none"
+) -> tuple:
     """
     Load model and tokenizer, with caching.
     
     Args:
         model_path: Path to model (either base model name or fine-tuned model path)
         base_model_name: Base model name if model_path is a fine-tuned LoRA model
+        quantization: Weight-only quantization for the loaded weights ("none", "int8" or "nf4")
         
     Returns:
         Tuple of (model, tokenizer)
     """
-    cache_key = model_path
+    # The same adapter directory applied to a different base is a different model
+    cache_key = (base_model_name, model_path, quantization)
     
-    if cache_key in _model_cache:
-        logger.info(f"Using cached model: {cache_key}")
-        return _model_cache[cache_key], _tokenizer_cache[cache_key]
+    with _model_cache_lock:
+        if cache_key in _model_cache:
+            logger.info(f"Using cached model: {cache_key}")
+            _model_cache.move_to_end(cache_key)
+            return _model_cache[cache_key]
+        load_lock = _model_load_locks.setdefault(cache_key, threading.Lock())
     
+    try:
+        with load_lock:
+            # Another request may have finished loading it while we waited
+            with _model_cache_lock:
+                if cache_key in _model_cache:
+                    _model_cache.move_to_end(cache_key)
+                    return _model_cache[cache_key]
+            
+            # Make room first so the new weights don't have to fit alongside the evicted ones
+            _evict_models(keep=MODEL_CACHE_SIZE - 1)
+            model, tokenizer = _load_model_uncached(model_path, base_model_name, quantization)
+            
+            with _model_cache_lock:
+                _model_cache[cache_key] = (model, tokenizer)
+    finally:
+        with _model_cache_lock:
+            # Waiters already hold this lock; later requests find the model cached
+            if _model_load_locks.get(cache_key) is load_lock:
+                del _model_load_locks[cache_key]
+    
+    # Loads of other models may have filled the cache while this one ran
+    _evict_models(keep=MODEL_CACHE_SIZE)
+    return model, tokenizer
+
+
+def _load_model_uncached(
+    model_path: str,
+    base_model_name: Optional[str],
+    quantization: Quantization
+) -> tuple:
+    """Load a model and its tokenizer from disk or the Hugging Face Hub."""
     logger.info(f"Loading model: {model_path}")
     
     # Load tokenizer
@@ -43,71 +203,122 @@ def load_model(model_path: str, base_model_name: Optional[str] = None) -> tuple:
     
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models continue from the right, so batches pad on the left
+    tokenizer.padding_side = "left"
     
     # Load model
     if base_model_name and os.path.exists(model_path):
         # Load base model first, then apply LoRA
-        base_model = AutoModelForCausalLM.from_pretrained(
-            base_model_name,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-        )
+        base_model = _from_pretrained(base_model_name, quantization)
         model = PeftModel.from_pretrained(base_model, model_path)
-        model = model.merge_and_unload()  # Merge LoRA weights for inference
+        # Quantized weights can't absorb the LoRA deltas, so those adapters stay separate
+        if quantization == "none":
+            model = model.merge_and_unload()  # Merge LoRA weights for inference
     elif os.path.exists(model_path):
         # Direct model path
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-        )
+        model = _from_pretrained(model_path, quantization)
     else:
         # Assume it's a HuggingFace model name
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-        )
+        model = _from_pretrained(model_path, quantization)
     
     model.eval()
     
-    # Cache models
-    _model_cache[cache_key] = model
-    _tokenizer_cache[cache_key] = tokenizer
-    
     return model, tokenizer
 
 
-def generate_text(
+def _get_vllm_engine(model_name: str):
+    """Return the vLLM engine for a model, creating it on first use."""
+    from vllm import LLM
+    
+    if model_name not in _vllm_engines:
+        if len(_vllm_engines) >= MAX_VLLM_ENGINES:
+            raise RuntimeError(
+                f"vLLM is already serving {', '.join(_vllm_engines)}; cannot also start "
+                f"{model_name}. Run a separate server per base model or unset USE_VLLM."
+            )
+        logger.info(f"Starting vLLM engine: {model_name}")
+        _vllm_engines[model_name] = LLM(
+            model=model_name,
+            # Same precision the transformers path resolved for this GPU
+            dtype=str(_DTYPE).removeprefix("torch."),
+            enable_lora=True,
+        )
+    return _vllm_engines[model_name]
+
+
+def _generate_batch_vllm(
     model_path: str,
-    prompt: str,
+    prompts: List[str],
+    max_tokens: int,
+    base_model_name: Optional[str]
+) -> List[Dict[str, Any]]:
+    """Generate text for prompts with vLLM, which schedules its own batches."""
+    from vllm import SamplingParams
+    from vllm.lora.request import LoRARequest
+    
+    start_time = time.time()
+    sampling_params = SamplingParams(temperature=0.7, top_p=0.9, max_tokens=max_tokens)
+    
+    # vLLM engines are not safe to drive from several threads at once
+    with _vllm_lock:
+        if base_model_name and os.path.exists(model_path):
+            llm = _get_vllm_engine(base_model_name)
+            lora_id = _vllm_lora_ids.setdefault(model_path, len(_vllm_lora_ids) + 1)
+            lora_request = LoRARequest(f"lora_{lora_id}", lora_id, model_path)
+        else:
+            llm = _get_vllm_engine(model_path)
+            lora_request = None
+        
+        outputs = llm.generate(prompts, sampling_params, lora_request=lora_request, use_tqdm=False)
+    
+    latency_ms = int((time.time() - start_time) * 1000 / len(prompts))
+    return [
+        {
+            "output": output.outputs[0].text.strip(),
+            "latency_ms": latency_ms,
+            "tokens_used": len(output.outputs[0].token_ids)
+        }
+        for output in outputs
+    ]
+
+
+def generate_batch(
+    model_path: str,
+    prompts: List[str],
     max_tokens: int = 256,
-    base_model_name: Optional[str] = None
-) -> Dict[str, Any]:
+    base_model_name: Optional[str] = None,
+    quantization: Quantization = "none"
+) -> List[Dict[str, Any]]:
     """
-    Generate text using a model.
+    Generate text for several prompts with a single model.generate call.
     
     Args:
         model_path: Path to model or model name
-        prompt: Input prompt
-        max_tokens: Maximum tokens to generate
+        prompts: Input prompts
+        max_tokens: Maximum tokens to generate per prompt
         base_model_name: Base model name if using LoRA fine-tuned model
+        quantization: Weight-only quantization to load the model with (HF backend only)
         
     Returns:
-        Dictionary with output, latency_ms, and tokens_used
+        List of dictionaries with output, latency_ms, and tokens_used, one per
+        prompt. The batch latency is split evenly across its prompts.
     """
+    if USE_VLLM:
+        if quantization != "none":
+            logger.warning(f"Ignoring {quantization} quantization: not supported with USE_VLLM")
+        return _generate_batch_vllm(model_path, prompts, max_tokens, base_model_name)
+    
     start_time = time.time()
     
     try:
-        model, tokenizer = load_model(model_path, base_model_name)
+        model, tokenizer = load_model(model_path, base_model_name, quantization)
         
-        # Tokenize input
-        inputs = tokenizer(prompt, return_tensors="pt")
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+        # Tokenize input; non-blocking copies let the transfer overlap queued GPU work
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        inputs = {k: v.to(_DEVICE, non_blocking=True) for k, v in inputs.items()}
         
         # Generate
-        with torch.no_grad():
+        with torch.inference_mode(), torch.backends.cuda.sdp_kernel(enable_flash=True, enable_mem_efficient=True):
             outputs = model.generate(
                 **inputs,
                 max_new_tokens=max_tokens,
@@ -117,35 +328,51 @@ def generate_text(
                 pad_token_id=tokenizer.pad_token_id,
             )
         
-        # Decode output
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Remove prompt from output
-        if generated_text.startswith(prompt):
-            output = generated_text[len(prompt):].strip()
-        else:
-            output = generated_text.strip()
+        # Left padding aligns every prompt to end at the same position, so the
+        # generated tokens are everything after it
+        generated = outputs[:, inputs["input_ids"].shape[1]:]
+        generated_texts = tokenizer.batch_decode(generated, skip_special_tokens=True)
         
         # Calculate metrics
-        latency_ms = int((time.time() - start_time) * 1000)
-        tokens_used = len(outputs[0]) - len(inputs["input_ids"][0])
+        latency_ms = int((time.time() - start_time) * 1000 / len(prompts))
+        tokens_used = (generated != tokenizer.pad_token_id).sum(dim=1).tolist()
         
-        return {
-            "output": output,
-            "latency_ms": latency_ms,
-            "tokens_used": tokens_used
-        }
+        return [
+            {
+                "output": text.strip(),
+                "latency_ms": latency_ms,
+                "tokens_used": tokens
+            }
+            for text, tokens in zip(generated_texts, tokens_used)
+        ]
         
     except Exception as e:
         logger.error(f"Generation error: {str(e)}", exc_info=True)
         raise
 
 
+def generate_text(
+    model_path: str,
+    prompt: str,
+    max_tokens: int = 256,
+    base_model_name: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Generate text using a model.
+    
+    Args:
+        model_path: Path to model or model name
+        prompt: Input prompt
+        max_tokens: Maximum tokens to generate
+        base_model_name: Base model name if using LoRA fine-tuned model
+        
+    Returns:
+        Dictionary with output, latency_ms, and tokens_used
+    """
+    return generate_batch(model_path, [prompt], max_tokens, base_model_name)[0]
+
+
 def clear_model_cache():
     """Clear the model cache to free memory."""
-    global _model_cache, _tokenizer_cache
-    _model_cache.clear()
-    _tokenizer_cache.clear()
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+    _evict_models(keep=0)
 
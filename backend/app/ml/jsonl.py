@@ -0,0 +1,45 @@
+"""Memory-mapped JSONL reading helpers."""
+import mmap
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+import numpy as np
+
+
+@contextmanager
+def map_file(file_path: str) -> Iterator[bytes]:
+    """Memory-map a file read-only. Empty files (which cannot be mapped) yield b""."""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def line_spans(buffer) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the start and end byte offsets of every line in a buffer."""
+    newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == 0x0A)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buffer)]))
+    
+    # A trailing newline ends the last line rather than starting a new one
+    if len(starts) > 1 and starts[-1] == len(buffer):
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends
+
+
+def iter_lines(file_path: str) -> Iterator[bytes]:
+    """Yield every line of a file as bytes, without its newline."""
+    with map_file(file_path) as buffer:
+        starts, ends = line_spans(buffer)
+        for start, end in zip(starts, ends):
+            yield buffer[start:end]
+
+
+def tail_lines(file_path: str, num_lines: int) -> List[bytes]:
+    """Return the last num_lines lines of a file without splitting the lines before them."""
+    with map_file(file_path) as buffer:
+        starts, ends = line_spans(buffer)
+        return [buffer[start:end] for start, end in zip(starts[-num_lines:], ends[-num_lines:])]
@@ -1,25 +1,32 @@
 """Fine-tuning logic using LoRA."""
 import os
-import json
 import asyncio
+import threading
 from typing import Dict, Any, Optional
 from datetime import datetime
+import orjson
 import torch
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     TrainingArguments,
     Trainer,
-    DataCollatorForLanguageModeling
+    TrainerCallback,
+    default_data_collator
 )
 from peft import LoraConfig, get_peft_model, TaskType
 from datasets import Dataset as HFDataset
+from app.ml.jsonl import iter_lines
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class TrainingCancelled(Exception):
+    """Raised by start_training when its cancel event stopped the run early."""
+
+
 # Default LoRA config
 LORA_CONFIG = {
     "r": 8,
@@ -36,21 +43,22 @@ DEFAULT_TRAINING_CONFIG = {
     "batch_size": 4,
     "learning_rate": 2e-4,
     "max_seq_length": 512,
+    "gradient_accumulation_steps": 1,
 }
 
 
+def _iter_jsonl(file_path: str):
+    """Yield examples from a JSONL file one line at a time."""
+    for line in iter_lines(file_path):
+        line = line.strip()
+        if not line:
+            continue
+        yield orjson.loads(line)
+
+
 def load_dataset_from_jsonl(file_path: str) -> HFDataset:
-    """Load dataset from JSONL file."""
-    examples = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            example = json.loads(line)
-            examples.append(example)
-    
-    return HFDataset.from_list(examples)
+    """Load dataset from JSONL file, streaming rows into Arrow storage."""
+    return HFDataset.from_generator(_iter_jsonl, gen_kwargs={"file_path": file_path})
 
 
 def format_prompt_completion(example: Dict[str, str]) -> str:
@@ -61,24 +69,48 @@ def format_prompt_completion(example: Dict[str, str]) -> str:
 
 
 def tokenize_function(examples, tokenizer, max_length: int):
-    """Tokenize examples for training."""
-    texts = [format_prompt_completion(ex) for ex in zip(examples["prompt"], examples["completion"])]
-    tokenized = tokenizer(
-        texts,
-        truncation=True,
-        max_length=max_length,
-        padding="max_length",
-        return_tensors="pt"
-    )
-    tokenized["labels"] = tokenized["input_ids"].clone()
-    return tokenized
+    """
+    Tokenize examples for training, packed into max_length-token blocks.
+    
+    Examples are concatenated with EOS separators rather than each being
+    padded to max_length. Each EOS keeps its label so the model learns where
+    an example ends; the first token of the next example, which would be
+    predicted from that EOS, and the padding of the final partial block are
+    masked out of the loss with -100 labels.
+    """
+    texts = [
+        format_prompt_completion({"prompt": prompt, "completion": completion})
+        for prompt, completion in zip(examples["prompt"], examples["completion"])
+    ]
+    
+    input_ids = []
+    labels = []
+    for ids in tokenizer(texts)["input_ids"]:
+        if not ids:
+            continue
+        input_ids.extend(ids)
+        # After a separator, the first token is predicted from the previous example's EOS
+        labels.extend([-100] + ids[1:] if labels else ids)
+        input_ids.append(tokenizer.eos_token_id)
+        labels.append(tokenizer.eos_token_id)
+    
+    packed = {"input_ids": [], "attention_mask": [], "labels": []}
+    for start in range(0, len(input_ids), max_length):
+        block_ids = input_ids[start:start + max_length]
+        block_labels = labels[start:start + max_length]
+        padding = max_length - len(block_ids)
+        packed["input_ids"].append(block_ids + [tokenizer.pad_token_id] * padding)
+        packed["attention_mask"].append([1] * len(block_ids) + [0] * padding)
+        packed["labels"].append(block_labels + [-100] * padding)
+    return packed
 
 
 async def start_training(
     dataset_id: int,
     dataset_path: str,
     config: Dict[str, Any],
-    progress_callback: Optional[callable] = None
+    progress_callback: Optional[callable] = None,
+    cancel_event: Optional[threading.Event] = None
 ) -> str:
     """
     Start fine-tuning job.
@@ -88,10 +120,14 @@ async def start_training(
         dataset_path: Path to JSONL dataset file
         config: Training configuration
         progress_callback: Optional callback function(step, loss, epoch)
-        
+        cancel_event: Optional event that stops training after the current step
+    
     Returns:
         Path to saved model
     """
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    
     try:
         # Merge configs
         training_config = {**DEFAULT_TRAINING_CONFIG, **config}
@@ -105,11 +141,20 @@ async def start_training(
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
         
-        # Load model
+        # Load model (bf16 where the GPU supports it: same memory as fp16, no loss scaling)
+        use_cuda = torch.cuda.is_available()
+        use_bf16 = use_cuda and torch.cuda.is_bf16_supported()
+        if use_bf16:
+            dtype = torch.bfloat16
+        elif use_cuda:
+            dtype = torch.float16
+        else:
+            dtype = torch.float32
+        
         model = AutoModelForCausalLM.from_pretrained(
             base_model_name,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
+            torch_dtype=dtype,
+            device_map="auto" if use_cuda else None,
         )
         
         # Apply LoRA
@@ -125,6 +170,12 @@ async def start_training(
         model = get_peft_model(model, lora_config)
         model.print_trainable_parameters()
         
+        # Recompute activations in the backward pass instead of keeping them all.
+        # Inputs must require grad for checkpointing to reach the frozen base layers.
+        model.config.use_cache = False
+        model.gradient_checkpointing_enable()
+        model.enable_input_require_grads()
+        
         # Load dataset
         logger.info(f"Loading dataset from {dataset_path}")
         dataset = load_dataset_from_jsonl(dataset_path)
@@ -151,30 +202,42 @@ async def start_training(
             output_dir=output_dir,
             num_train_epochs=training_config["num_epochs"],
             per_device_train_batch_size=training_config["batch_size"],
+            gradient_accumulation_steps=training_config["gradient_accumulation_steps"],
             learning_rate=training_config["learning_rate"],
             logging_steps=10,
             save_steps=100,
             save_total_limit=3,
-            fp16=torch.cuda.is_available(),
+            gradient_checkpointing=True,
+            # Paged 8-bit AdamW keeps a quarter of the optimizer state (bitsandbytes, CUDA only)
+            optim="paged_adamw_8bit" if use_cuda else "adamw_torch",
+            bf16=use_bf16,
+            fp16=use_cuda and not use_bf16,
             report_to=None,  # Disable wandb/tensorboard for MVP
         )
         
-        # Data collator
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=tokenizer,
-            mlm=False
-        )
+        # Blocks are already fixed-length with labels set, so just stack them
+        data_collator = default_data_collator
+        
+        # Training runs in a worker thread; progress is handed back to the event loop
+        loop = asyncio.get_running_loop()
         
         # Custom trainer with progress callback
         class ProgressTrainer(Trainer):
             def log(self, logs: Dict[str, float]) -> None:
                 super().log(logs)
                 if progress_callback and "loss" in logs:
-                    step = logs.get("step", 0)
+                    # Trainer.log only records the step in log_history, not in logs
+                    step = self.state.global_step
                     loss = logs.get("loss", 0.0)
                     epoch = logs.get("epoch", 0.0)
                     if progress_callback:
-                        asyncio.create_task(progress_callback(step, loss, epoch))
+                        asyncio.run_coroutine_threadsafe(progress_callback(step, loss, epoch), loop)
+        
+        # Checked from the training thread between optimizer steps
+        class CancelCallback(TrainerCallback):
+            def on_step_end(self, args, state, control, **kwargs):
+                if cancel_event.is_set():
+                    control.should_training_stop = True
         
         # Create trainer
         trainer = ProgressTrainer(
@@ -182,11 +245,23 @@ async def start_training(
             args=training_args,
             train_dataset=tokenized_dataset,
             data_collator=data_collator,
+            callbacks=[CancelCallback()],
         )
         
         # Train
         logger.info("Starting training...")
-        trainer.train()
+        training = asyncio.ensure_future(asyncio.to_thread(trainer.train))
+        try:
+            await asyncio.shield(training)
+        except asyncio.CancelledError:
+            # Cancelling the await can't stop the thread, so stop it cooperatively and
+            # wait for it; callers hold their GPU slot until the model is released
+            cancel_event.set()
+            await asyncio.wait({training})
+            raise
+        
+        if cancel_event.is_set():
+            raise TrainingCancelled("Training was cancelled")
         
         # Save final model
         final_model_path = os.path.join(output_dir, "final_model")
@@ -195,7 +270,10 @@ async def start_training(
         
         logger.info(f"Training completed. Model saved to {final_model_path}")
         return final_model_path
-        
+    
+    except TrainingCancelled:
+        logger.info("Training cancelled")
+        raise
     except Exception as e:
         logger.error(f"Training error: {str(e)}", exc_info=True)
         raise
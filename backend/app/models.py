@@ -1,5 +1,5 @@
 """SQLAlchemy database models."""
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, TIMESTAMP, JSON, ARRAY
+from sqlalchemy import Column, BigInteger, Integer, Float, String, Text, ForeignKey, Index, TIMESTAMP, JSON, ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -29,13 +29,36 @@ class TrainingJob(Base):
     status = Column(String(50))  # 'queued', 'training', 'completed', 'failed'
     config = Column(JSON)
     model_path = Column(Text)
-    training_logs = Column(JSON)  # Array of {step, loss, timestamp}
+    created_at = Column(TIMESTAMP, server_default=func.now())
     started_at = Column(TIMESTAMP)
     completed_at = Column(TIMESTAMP)
     error_message = Column(Text)
 
-    dataset = relationship("Dataset", back_populates="training_jobs")
+    # Loaded with the job unless a query opts out with raiseload
+    dataset = relationship("Dataset", back_populates="training_jobs", lazy="selectin")
     evaluations = relationship("Evaluation", back_populates="training_job")
+    training_logs = relationship(
+        "TrainingLog",
+        back_populates="training_job",
+        # id breaks ties in insertion order
+        order_by="[TrainingLog.step, TrainingLog.id]",
+        cascade="all, delete-orphan"
+    )
+
+
+class TrainingLog(Base):
+    """Training log model for per-step loss recorded during fine-tuning."""
+    __tablename__ = "training_logs"
+    __table_args__ = (Index("ix_training_logs_job_id_step", "job_id", "step"),)
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("training_jobs.id"), nullable=False)
+    step = Column(Integer, nullable=False)
+    loss = Column(Float)
+    epoch = Column(Float)
+    ts_ns = Column(BigInteger)  # time.time_ns() when the step was logged
+
+    training_job = relationship("TrainingJob", back_populates="training_logs")
 
 
 class Evaluation(Base):
@@ -44,14 +67,41 @@ class Evaluation(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     training_job_id = Column(Integer, ForeignKey("training_jobs.id"), nullable=False)
-    test_results = Column(JSON)  # Stores all comparison results
+    status = Column(String(50))  # 'queued', 'running', 'completed', 'failed'
     metrics = Column(JSON)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    completed_at = Column(TIMESTAMP)
+    error_message = Column(Text)
 
-    training_job = relationship("TrainingJob", back_populates="evaluations")
+    training_job = relationship("TrainingJob", back_populates="evaluations", lazy="selectin")
+    test_results = relationship(
+        "EvaluationExample",
+        back_populates="evaluation",
+        order_by="EvaluationExample.idx",
+        cascade="all, delete-orphan"
+    )
     user_ratings = relationship("UserRating", back_populates="evaluation")
 
 
+class EvaluationExample(Base):
+    """Evaluation example model for one prompt's base vs fine-tuned outputs."""
+    __tablename__ = "evaluation_examples"
+    __table_args__ = (Index("ix_evaluation_examples_evaluation_id_idx", "evaluation_id", "idx"),)
+
+    id = Column(Integer, primary_key=True)
+    evaluation_id = Column(Integer, ForeignKey("evaluations.id"), nullable=False)
+    idx = Column(Integer, nullable=False)
+    prompt = Column(Text, nullable=False)
+    base_output = Column(Text)
+    finetuned_output = Column(Text)
+    base_latency_ms = Column(Integer)
+    finetuned_latency_ms = Column(Integer)
+    base_tokens = Column(Integer)
+    finetuned_tokens = Column(Integer)
+
+    evaluation = relationship("Evaluation", back_populates="test_results")
+
+
 class UserRating(Base):
     """User rating model for tracking which model users prefer."""
     __tablename__ = "user_ratings"
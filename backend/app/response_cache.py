@@ -0,0 +1,50 @@
+"""ETags and an in-process cache for job and evaluation responses."""
+import hashlib
+from typing import Any, Awaitable, Callable, Optional
+from cachetools import TTLCache
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+# Statuses after which a job's or evaluation's payload no longer changes
+FINAL_STATUSES = ("completed", "failed")
+
+# Serialized bodies of finished responses, keyed by ETag
+_response_cache: "TTLCache[str, bytes]" = TTLCache(maxsize=512, ttl=60)
+
+
+def make_etag(*parts: Any) -> str:
+    """Build a short quoted ETag from the values a response is derived from."""
+    digest = hashlib.blake2b(":".join(str(part) for part in parts).encode()).hexdigest()[:16]
+    return f'"{digest}"'
+
+
+async def etag_response(
+    request: Request,
+    etag: str,
+    status: Optional[str],
+    build: Callable[[], Awaitable[BaseModel]]
+) -> Response:
+    """
+    Answer a GET with 304 if the client already has this ETag, else with the body.
+    
+    Args:
+        request: Incoming request, checked for If-None-Match
+        etag: ETag of the current payload
+        status: Status of the job or evaluation; final ones have their body cached
+        build: Coroutine function producing the response model, only called on a miss
+    
+    Returns:
+        304 or JSON response carrying the ETag
+    """
+    # no-cache makes browsers revalidate on every poll instead of guessing freshness
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    body = _response_cache.get(etag)
+    if body is None:
+        body = (await build()).model_dump_json().encode()
+        if status in FINAL_STATUSES:
+            _response_cache[etag] = body
+    
+    return Response(content=body, media_type="application/json", headers=headers)
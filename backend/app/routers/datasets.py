@@ -1,10 +1,14 @@
 """Dataset management endpoints."""
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import asyncio
 import os
-import shutil
 from datetime import datetime
+import aiofiles
 
 from app.database import get_db
 from app.models import Dataset
@@ -17,11 +21,24 @@ router = APIRouter(prefix="/api/datasets", tags=["datasets"])
 DATASETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "datasets")
 os.makedirs(DATASETS_DIR, exist_ok=True)
 
+# Bytes read from the upload per await, so large files never block the event loop for long
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Most chunks of lines an upload buffers ahead of its validator
+UPLOAD_QUEUE_CHUNKS = 8
+
+# A validator blocks on its upload for the whole request, so validators get threads of
+# their own; on the default executor they could starve the aiofiles writes feeding them
+_validation_executor = ThreadPoolExecutor(thread_name_prefix="dataset-validation")
+
+# Built once at import instead of per request
+_LIST_DATASETS = select(Dataset).order_by(Dataset.created_at.desc())
+
 
 @router.post("", response_model=DatasetResponse, status_code=201)
 async def upload_dataset(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Upload a training dataset in JSONL format.
@@ -35,14 +52,48 @@ async def upload_dataset(
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     file_path = os.path.join(DATASETS_DIR, f"{timestamp}_{file.filename}")
     
+    # Validate lines as they are written instead of reading the saved file back
+    loop = asyncio.get_running_loop()
+    pending_lines: "asyncio.Queue[Optional[List[bytes]]]" = asyncio.Queue(UPLOAD_QUEUE_CHUNKS)
+    
+    def next_lines() -> Optional[List[bytes]]:
+        return asyncio.run_coroutine_threadsafe(pending_lines.get(), loop).result()
+    
+    def validate_upload():
+        finished = False
+        
+        def uploaded_lines():
+            nonlocal finished
+            while (lines := next_lines()) is not None:
+                yield from lines
+            finished = True
+        
+        try:
+            return validate_dataset(uploaded_lines())
+        finally:
+            # Keep consuming so the writer never waits on a full queue forever
+            while not finished and next_lines() is not None:
+                pass
+    
+    validation = loop.run_in_executor(_validation_executor, validate_upload)
+    
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Bytes after the last newline seen so far, completed by the next chunk
+        tail = b""
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await buffer.write(chunk)
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                await pending_lines.put(lines)
+        if tail:
+            await pending_lines.put([tail])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    finally:
+        await pending_lines.put(None)
     
-    # Validate dataset
-    validation_result = validate_dataset(file_path)
+    validation_result = await validation
     
     # Create dataset record
     dataset = Dataset(
@@ -54,32 +105,33 @@ async def upload_dataset(
     )
     
     db.add(dataset)
-    db.commit()
-    db.refresh(dataset)
+    await db.commit()
+    await db.refresh(dataset)
     
     return dataset
 
 
 @router.get("", response_model=List[DatasetResponse])
-def list_datasets(db: Session = Depends(get_db)):
+async def list_datasets(db: AsyncSession = Depends(get_db)):
     """List all uploaded datasets."""
-    datasets = db.query(Dataset).order_by(Dataset.created_at.desc()).all()
-    return datasets
+    datasets = await db.scalars(_LIST_DATASETS)
+    return datasets.all()
 
 
 @router.get("/{dataset_id}", response_model=DatasetResponse)
-def get_dataset(dataset_id: int, db: Session = Depends(get_db)):
+async def get_dataset(dataset_id: int, db: AsyncSession = Depends(get_db)):
     """Get dataset details by ID."""
-    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    dataset = await db.get(Dataset, dataset_id)
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     return dataset
 
 
 @router.delete("/{dataset_id}", status_code=204)
-def delete_dataset(dataset_id: int, db: Session = Depends(get_db)):
+async def delete_dataset(dataset_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a dataset and its file."""
-    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    # The delete cascade walks training_jobs, which async sessions can't lazy-load
+    dataset = await db.get(Dataset, dataset_id, options=[selectinload(Dataset.training_jobs)])
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     
@@ -90,7 +142,7 @@ def delete_dataset(dataset_id: int, db: Session = Depends(get_db)):
         except Exception as e:
             pass  # Continue even if file deletion fails
     
-    db.delete(dataset)
-    db.commit()
+    await db.delete(dataset)
+    await db.commit()
     return None
 
@@ -1,23 +1,40 @@
 """Evaluation endpoints."""
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional, Set
+from datetime import datetime
 
-from app.database import get_db
-from app.models import Evaluation, TrainingJob, Dataset, UserRating
+from app.database import SessionLocal, get_db
+from app.models import Evaluation, EvaluationExample, TrainingJob, UserRating
 from app.schemas import (
     EvaluationCreate,
     EvaluationResponse,
     UserRatingCreate,
-    UserRatingResponse,
-    TestExample,
-    EvaluationMetrics
+    UserRatingResponse
 )
 from app.ml.evaluator import evaluate_models
+from app.response_cache import etag_response, make_etag
 import asyncio
+import os
 
 router = APIRouter(prefix="/api/evaluation", tags=["evaluation"])
 
+# Running evaluation tasks (the event loop itself only keeps weak references)
+_active_evaluation_tasks: Set[asyncio.Task] = set()
+
+# Each evaluation loads two models, so only this many run at once
+_evaluation_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_EVALUATIONS", "1")))
+
+# Built once at import; each request only adds its page bounds
+_EXAMPLES_FOR_EVALUATION = (
+    select(EvaluationExample)
+    .where(EvaluationExample.evaluation_id == bindparam("evaluation_id"))
+    .order_by(EvaluationExample.idx)
+)
+
 
 async def run_evaluation_task(
     evaluation_id: int,
@@ -25,43 +42,76 @@ async def run_evaluation_task(
     base_model_name: str,
     finetuned_model_path: str,
     test_size: int,
-    db: Session
+    quantization: str
 ):
     """Background task for running evaluation."""
-    evaluation = db.query(Evaluation).filter(Evaluation.id == evaluation_id).first()
-    if not evaluation:
-        return
-    
-    try:
-        # Run evaluation
-        results = await evaluate_models(
-            dataset_path,
-            base_model_name,
-            finetuned_model_path,
-            test_size
-        )
-        
-        # Store results
-        evaluation.test_results = results["test_results"]
-        evaluation.metrics = results["metrics"]
-        db.commit()
+    # Wait for a free slot. The request's session closes with the response, so
+    # the task opens its own.
+    async with _evaluation_semaphore, SessionLocal() as db:
+        evaluation = await db.get(Evaluation, evaluation_id, options=[raiseload("*")])
+        if not evaluation:
+            return
         
-    except Exception as e:
-        evaluation.metrics = {"error": str(e)}
-        db.commit()
+        try:
+            evaluation.status = "running"
+            await db.commit()
+            
+            # Run evaluation
+            results = await evaluate_models(
+                dataset_path,
+                base_model_name,
+                finetuned_model_path,
+                test_size,
+                quantization
+            )
+            
+            # Store results, one row per example in a single executemany
+            if results["test_results"]:
+                await db.execute(
+                    insert(EvaluationExample),
+                    [
+                        {"evaluation_id": evaluation.id, "idx": i, **example}
+                        for i, example in enumerate(results["test_results"])
+                    ]
+                )
+            evaluation.metrics = results["metrics"]
+            evaluation.status = "completed"
+            evaluation.completed_at = datetime.now()
+            await db.commit()
+            
+        except Exception as e:
+            # Discard any example rows written before the failure
+            await db.rollback()
+            evaluation.status = "failed"
+            evaluation.error_message = str(e)
+            evaluation.completed_at = datetime.now()
+            await db.commit()
+
+
+async def launch_evaluation_task(*args):
+    """Start an evaluation on the event loop, holding a reference until it finishes."""
+    task = asyncio.create_task(run_evaluation_task(*args))
+    _active_evaluation_tasks.add(task)
+    task.add_done_callback(_active_evaluation_tasks.discard)
 
 
-@router.post("/run", response_model=EvaluationResponse, status_code=201)
+@router.post("/run", response_model=EvaluationResponse, status_code=202)
 async def run_evaluation(
     request: EvaluationCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Run evaluation comparing base and fine-tuned models."""
-    # Get training job
-    training_job = db.query(TrainingJob).filter(
-        TrainingJob.id == request.training_job_id
-    ).first()
+    """
+    Start an evaluation comparing base and fine-tuned models.
+    
+    Returns immediately with status "queued"; poll GET /{evaluation_id} for results.
+    """
+    # Get training job together with its dataset
+    training_job = await db.get(
+        TrainingJob,
+        request.training_job_id,
+        options=[selectinload(TrainingJob.dataset), raiseload("*")]
+    )
     
     if not training_job:
         raise HTTPException(status_code=404, detail="Training job not found")
@@ -75,8 +125,7 @@ async def run_evaluation(
     if not training_job.model_path:
         raise HTTPException(status_code=400, detail="Model path not found")
     
-    # Get dataset
-    dataset = db.query(Dataset).filter(Dataset.id == training_job.dataset_id).first()
+    dataset = training_job.dataset
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     
@@ -86,77 +135,72 @@ async def run_evaluation(
     # Create evaluation record
     evaluation = Evaluation(
         training_job_id=request.training_job_id,
+        status="queued",
         test_results=[],
         metrics={}
     )
     
     db.add(evaluation)
-    db.commit()
-    db.refresh(evaluation)
-    
-    # Run evaluation in background
-    asyncio.create_task(
-        run_evaluation_task(
-            evaluation.id,
-            dataset.file_path,
-            base_model_name,
-            training_job.model_path,
-            request.test_size,
-            db
-        )
+    await db.commit()
+    # Only created_at comes from the database; a full refresh would expire the
+    # (empty) test_results, which can't be lazy-loaded
+    await db.refresh(evaluation, ["created_at"])
+    
+    # Run evaluation in background once the response has been sent
+    background_tasks.add_task(
+        launch_evaluation_task,
+        evaluation.id,
+        dataset.file_path,
+        base_model_name,
+        training_job.model_path,
+        request.test_size,
+        request.quantization
     )
     
-    # Wait a bit for initial results
-    await asyncio.sleep(2)
-    
-    # Refresh to get updated results
-    db.refresh(evaluation)
-    
     return evaluation
 
 
 @router.get("/{evaluation_id}", response_model=EvaluationResponse)
-def get_evaluation(evaluation_id: int, db: Session = Depends(get_db)):
-    """Get evaluation results."""
-    evaluation = db.query(Evaluation).filter(Evaluation.id == evaluation_id).first()
+async def get_evaluation(
+    evaluation_id: int,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get evaluation results, optionally a page of the test examples."""
+    evaluation = await db.get(Evaluation, evaluation_id, options=[raiseload("*")])
     if not evaluation:
         raise HTTPException(status_code=404, detail="Evaluation not found")
     
-    # Convert test_results to proper format
-    if evaluation.test_results:
-        test_examples = [
-            TestExample(**result) for result in evaluation.test_results
-        ]
-    else:
-        test_examples = []
-    
-    # Convert metrics
-    if evaluation.metrics:
-        metrics = EvaluationMetrics(**evaluation.metrics)
-    else:
-        metrics = EvaluationMetrics(
-            base_model={},
-            finetuned_model={}
+    # Results and metrics are only written together with the final status
+    etag = make_etag(
+        "evaluation", evaluation.id, evaluation.status, evaluation.completed_at, offset, limit
+    )
+    
+    async def build() -> EvaluationResponse:
+        examples = await db.scalars(
+            _EXAMPLES_FOR_EVALUATION.offset(offset).limit(limit),
+            {"evaluation_id": evaluation_id}
         )
+        # Attach the page as the loaded collection without marking it as a change
+        set_committed_value(evaluation, "test_results", examples.all())
+        
+        # Nested results and metrics are validated straight from the ORM row
+        return EvaluationResponse.model_validate(evaluation)
     
-    return {
-        "id": evaluation.id,
-        "training_job_id": evaluation.training_job_id,
-        "test_results": test_examples,
-        "metrics": metrics,
-        "created_at": evaluation.created_at
-    }
+    return await etag_response(request, etag, evaluation.status, build)
 
 
 @router.post("/{evaluation_id}/rate", response_model=UserRatingResponse, status_code=201)
-def submit_rating(
+async def submit_rating(
     evaluation_id: int,
     request: UserRatingCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Submit a user rating for a model comparison."""
     # Verify evaluation exists
-    evaluation = db.query(Evaluation).filter(Evaluation.id == evaluation_id).first()
+    evaluation = await db.get(Evaluation, evaluation_id, options=[raiseload("*")])
     if not evaluation:
         raise HTTPException(status_code=404, detail="Evaluation not found")
     
@@ -168,8 +212,8 @@ def submit_rating(
     )
     
     db.add(rating)
-    db.commit()
-    db.refresh(rating)
+    await db.commit()
+    await db.refresh(rating)
     
     return rating
 
@@ -1,11 +1,12 @@
 """Inference endpoints."""
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
 
 from app.database import get_db
 from app.models import TrainingJob
 from app.schemas import InferenceRequest, InferenceResponse
-from app.ml.inference import generate_text
+from app.ml.infer_queue import InferenceBatcher
 
 router = APIRouter(prefix="/api/inference", tags=["inference"])
 
@@ -13,11 +14,12 @@ router = APIRouter(prefix="/api/inference", tags=["inference"])
 @router.post("", response_model=InferenceResponse)
 async def run_inference(
     request: InferenceRequest,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
 ):
     """Generate text using a fine-tuned model."""
     # Get training job
-    training_job = db.query(TrainingJob).filter(TrainingJob.id == request.model_id).first()
+    training_job = await db.get(TrainingJob, request.model_id, options=[raiseload("*")])
     
     if not training_job:
         raise HTTPException(status_code=404, detail="Model not found")
@@ -34,14 +36,14 @@ async def run_inference(
     # Get base model name from config
     base_model_name = training_job.config.get("base_model", "meta-llama/Llama-3.1-8B")
     
+    # Concurrent requests for the same model share batched generate calls
+    batchers = http_request.app.state.batchers
+    if training_job.id not in batchers:
+        batchers[training_job.id] = InferenceBatcher(training_job.model_path, base_model_name)
+    
     try:
         # Run inference
-        result = generate_text(
-            training_job.model_path,
-            request.prompt,
-            max_tokens=request.max_tokens,
-            base_model_name=base_model_name
-        )
+        result = await batchers[training_job.id].submit(request.prompt, request.max_tokens)
         
         return InferenceResponse(
             output=result["output"],
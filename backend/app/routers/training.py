@@ -1,110 +1,269 @@
 """Training job management endpoints."""
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import raiseload
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 import asyncio
-from typing import Dict, Any, List
+import orjson
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 
-from app.database import get_db
-from app.models import TrainingJob, Dataset
+from app.database import SessionLocal, get_db
+from app.models import TrainingJob, TrainingLog, Dataset
 from app.schemas import TrainingJobCreate, TrainingJobResponse, TrainingConfig
-from app.ml.trainer import start_training
+from app.schemas import TrainingLog as TrainingLogSchema
+from app.ml.trainer import TrainingCancelled, start_training
+from app.response_cache import etag_response, make_etag
 
 router = APIRouter(prefix="/api/training", tags=["training"])
 
-# Store active training tasks
-_active_training_tasks: Dict[int, asyncio.Task] = {}
+# Defaults validated once per process rather than per request
+_DEFAULT_TRAINING_CONFIG = TrainingConfig().model_dump(mode="json")
 
+# Job statuses that mean a training task exists (or is about to) for the job
+ACTIVE_STATUSES = ("queued", "training")
 
-async def update_training_progress(
-    job_id: int,
-    step: int,
-    loss: float,
-    epoch: float,
-    db: Session
-):
-    """Update training progress in database."""
-    job = db.query(TrainingJob).filter(TrainingJob.id == job_id).first()
-    if not job:
-        return
+
+class TaskRegistry:
+    """Running training tasks by job id, safe to use from concurrent coroutines."""
     
-    # Initialize training_logs if needed
-    if job.training_logs is None:
-        job.training_logs = []
+    def __init__(self):
+        self._tasks: Dict[int, Tuple[asyncio.Task, threading.Event]] = {}
+        self._lock = asyncio.Lock()
     
-    # Add new log entry
-    log_entry = {
-        "step": step,
-        "loss": float(loss),
-        "epoch": float(epoch),
-        "timestamp": datetime.now().isoformat()
-    }
+    async def add(self, job_id: int, task: asyncio.Task, cancel_event: threading.Event):
+        async with self._lock:
+            self._tasks[job_id] = (task, cancel_event)
     
-    job.training_logs.append(log_entry)
-    db.commit()
+    async def remove(self, job_id: int):
+        async with self._lock:
+            self._tasks.pop(job_id, None)
+    
+    async def cancel(self, job_id: int) -> Optional[asyncio.Task]:
+        """
+        Ask a job's training loop to stop after its current step.
+        
+        Returns:
+            The job's task, which records the final status when it ends, or
+            None if the job has no running task
+        """
+        async with self._lock:
+            entry = self._tasks.get(job_id)
+        if entry is None:
+            return None
+        task, cancel_event = entry
+        cancel_event.set()
+        return task
+    
+    async def bootstrap(self, db: AsyncSession) -> int:
+        """
+        Fail jobs left active by a previous process, whose tasks died with it.
+        
+        Returns:
+            Number of jobs marked failed
+        """
+        result = await db.execute(
+            update(TrainingJob)
+            .where(TrainingJob.status.in_(ACTIVE_STATUSES))
+            .values(
+                status="failed",
+                error_message="Interrupted by server restart",
+                completed_at=datetime.now()
+            )
+        )
+        await db.commit()
+        return result.rowcount
+
+
+task_registry = TaskRegistry()
+
+# Makes the duplicate-job check and the insert in start_training_job atomic
+_start_lock = asyncio.Lock()
+
+# Each run holds a model on the GPU, so only this many train at once
+_training_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_TRAINING", "1")))
+
+# Training log entries are written in batches of this many, or at least this often
+LOG_FLUSH_ENTRIES = 50
+LOG_FLUSH_SECONDS = 5.0
+
+# How long a cancel request waits for training to stop at the end of its current
+# step before answering 202 and leaving the task to finish stopping
+CANCEL_TIMEOUT_SECONDS = 30.0
+
+# Log rows fetched and sent per chunk by the logs endpoint
+LOG_STREAM_BATCH = 256
+
+# Queries built once at import instead of per request; values are bound at execution
+_LIST_TRAINING_JOBS = (
+    select(TrainingJob)
+    .order_by(TrainingJob.created_at.desc())
+    .options(raiseload("*"))
+)
+_ACTIVE_JOB_FOR_DATASET = (
+    select(TrainingJob.id)
+    .where(TrainingJob.dataset_id == bindparam("dataset_id"))
+    .where(TrainingJob.status.in_(ACTIVE_STATUSES))
+    .limit(1)
+)
+_TRAINING_LOGS_FOR_JOB = (
+    select(TrainingLog)
+    .where(TrainingLog.job_id == bindparam("job_id"))
+    .order_by(TrainingLog.step, TrainingLog.id)
+    .execution_options(yield_per=LOG_STREAM_BATCH)
+)
+
+
+async def update_training_progress(
+    job_id: int,
+    log_entries: List[Dict[str, Any]]
+):
+    """Insert a batch of log entries for a job in one statement."""
+    async with SessionLocal() as db:
+        await db.execute(insert(TrainingLog), [{"job_id": job_id, **entry} for entry in log_entries])
+        await db.commit()
 
 
 async def run_training_task(
     job_id: int,
     dataset_path: str,
     config: Dict[str, Any],
-    db: Session
+    cancel_event: threading.Event
 ):
-    """Background task for running training."""
-    job = db.query(TrainingJob).filter(TrainingJob.id == job_id).first()
-    if not job:
-        return
+    """Background task for running training; it alone records the job's final status."""
+    # Log rows waiting to be inserted, flushed in batches instead of per step
+    pending_logs: List[Dict[str, Any]] = []
+    flush_lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    # Timer that writes whatever is pending once the oldest entry is LOG_FLUSH_SECONDS
+    # old, and the flush it started (held so the task isn't garbage collected)
+    flush_timer: Optional[asyncio.TimerHandle] = None
+    timed_flush: Optional[asyncio.Task] = None
+    
+    async def flush_logs():
+        nonlocal pending_logs, flush_timer
+        if flush_timer is not None:
+            flush_timer.cancel()
+            flush_timer = None
+        # Serialized so batches are inserted in step order
+        async with flush_lock:
+            log_entries, pending_logs = pending_logs, []
+            if log_entries:
+                await update_training_progress(job_id, log_entries)
+    
+    def start_timed_flush():
+        nonlocal flush_timer, timed_flush
+        flush_timer = None
+        timed_flush = asyncio.create_task(flush_logs())
+    
+    async def progress_callback(step: int, loss: float, epoch: float):
+        nonlocal flush_timer
+        pending_logs.append({
+            "step": step,
+            "loss": float(loss),
+            "epoch": float(epoch),
+            "ts_ns": time.time_ns()
+        })
+        if len(pending_logs) >= LOG_FLUSH_ENTRIES:
+            await flush_logs()
+        elif flush_timer is None:
+            # Steps arriving before the timer fires join the same insert, and the
+            # last entries are written even if no further step ever comes
+            flush_timer = loop.call_later(LOG_FLUSH_SECONDS, start_timed_flush)
     
     try:
-        job.status = "training"
-        job.started_at = datetime.now()
-        db.commit()
-        
-        # Progress callback
-        async def progress_callback(step: int, loss: float, epoch: float):
-            await update_training_progress(job_id, step, loss, epoch, db)
-        
-        # Run training
-        model_path = await start_training(
-            job_id,
-            dataset_path,
-            config,
-            progress_callback
-        )
-        
-        # Update job status
-        job.status = "completed"
-        job.model_path = model_path
-        job.completed_at = datetime.now()
-        db.commit()
-        
+        # Jobs stay "queued" until a slot frees up. The request's session closes with
+        # the response, so the task opens its own.
+        async with _training_semaphore, SessionLocal() as db:
+            job = await db.get(TrainingJob, job_id, options=[raiseload("*")])
+            # The job may have been cancelled while it waited for a slot
+            if not job or job.status != "queued":
+                return
+            
+            job.status = "training"
+            job.started_at = datetime.now()
+            await db.commit()
+            
+            # Run training
+            model_path = await start_training(
+                job_id,
+                dataset_path,
+                config,
+                progress_callback,
+                cancel_event
+            )
+            
+            # Logs go in before the final status, so clients that stop polling
+            # on it have every entry
+            await flush_logs()
+            
+            # Update job status
+            job.status = "completed"
+            job.model_path = model_path
+            job.completed_at = datetime.now()
+            await db.commit()
+    
+    except TrainingCancelled:
+        await flush_logs()
+        await fail_training_job(job_id, "Cancelled by user")
+    except asyncio.CancelledError:
+        # Cancelled while queued, or the server is shutting down; start_training
+        # only lets this through once its training thread has stopped
+        await flush_logs()
+        await fail_training_job(job_id, "Cancelled by user")
+        raise
     except Exception as e:
-        job.status = "failed"
-        job.error_message = str(e)
-        job.completed_at = datetime.now()
-        db.commit()
+        await flush_logs()
+        await fail_training_job(job_id, str(e))
     finally:
+        await flush_logs()
+        
         # Remove from active tasks
-        if job_id in _active_training_tasks:
-            del _active_training_tasks[job_id]
+        await task_registry.remove(job_id)
+
+
+async def fail_training_job(job_id: int, error_message: str):
+    """Mark a job failed in one commit, independent of any session it was loaded in."""
+    async with SessionLocal() as db:
+        await db.execute(
+            update(TrainingJob)
+            .where(TrainingJob.id == job_id)
+            .values(status="failed", error_message=error_message, completed_at=datetime.now())
+        )
+        await db.commit()
+
+
+async def launch_training_task(
+    job_id: int,
+    dataset_path: str,
+    config: Dict[str, Any]
+):
+    """Start a training run on the event loop and track it so it can be cancelled."""
+    cancel_event = threading.Event()
+    task = asyncio.create_task(run_training_task(job_id, dataset_path, config, cancel_event))
+    await task_registry.add(job_id, task, cancel_event)
 
 
 @router.get("", response_model=List[TrainingJobResponse])
-def list_training_jobs(db: Session = Depends(get_db)):
+async def list_training_jobs(db: AsyncSession = Depends(get_db)):
     """List all training jobs."""
-    jobs = db.query(TrainingJob).order_by(TrainingJob.created_at.desc()).all()
-    return jobs
+    jobs = await db.scalars(_LIST_TRAINING_JOBS)
+    return jobs.all()
 
 
 @router.post("/start", response_model=TrainingJobResponse, status_code=201)
 async def start_training_job(
     request: TrainingJobCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Start a new fine-tuning job."""
     # Verify dataset exists
-    dataset = db.query(Dataset).filter(Dataset.id == request.dataset_id).first()
+    dataset = await db.get(Dataset, request.dataset_id)
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     
@@ -114,61 +273,121 @@ async def start_training_job(
     # Prepare config
     config = {}
     if request.config:
-        config = request.config.dict()
+        config = request.config.model_dump(mode="json")
     else:
         # Use defaults
-        config = TrainingConfig().dict()
-    
-    # Create training job
-    job = TrainingJob(
-        dataset_id=request.dataset_id,
-        status="queued",
-        config=config,
-        training_logs=[]
-    )
-    
-    db.add(job)
-    db.commit()
-    db.refresh(job)
-    
-    # Start training in background
-    task = asyncio.create_task(
-        run_training_task(job.id, dataset.file_path, config, db)
-    )
-    _active_training_tasks[job.id] = task
+        config = dict(_DEFAULT_TRAINING_CONFIG)
+    
+    async with _start_lock:
+        # Training the same dataset twice at once would only load the model twice
+        active_job_id = await db.scalar(
+            _ACTIVE_JOB_FOR_DATASET,
+            {"dataset_id": request.dataset_id}
+        )
+        if active_job_id is not None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Dataset already has an active training job ({active_job_id})"
+            )
+        
+        # Create training job
+        job = TrainingJob(
+            dataset_id=request.dataset_id,
+            status="queued",
+            config=config
+        )
+        
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+    
+    # Start training once the response has been sent
+    background_tasks.add_task(launch_training_task, job.id, dataset.file_path, config)
     
     return job
 
 
 @router.get("/{job_id}", response_model=TrainingJobResponse)
-def get_training_job(job_id: int, db: Session = Depends(get_db)):
-    """Get training job status and logs."""
-    job = db.query(TrainingJob).filter(TrainingJob.id == job_id).first()
+async def get_training_job(
+    job_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """Get training job status; the logs are served by /{job_id}/logs."""
+    job = await db.get(TrainingJob, job_id, options=[raiseload("*")])
     if not job:
         raise HTTPException(status_code=404, detail="Training job not found")
-    return job
+    
+    # Every other field changes together with one of these
+    etag = make_etag("training_job", job.id, job.status, job.started_at, job.completed_at)
+    
+    async def build() -> TrainingJobResponse:
+        return TrainingJobResponse.model_validate(job)
+    
+    return await etag_response(request, etag, job.status, build)
+
+
+@router.get("/{job_id}/logs")
+async def get_training_logs(
+    job_id: int,
+    since_step: Optional[int] = Query(None, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream a job's training logs as NDJSON, one entry per line in step order.
+    
+    Pollers pass the last step they have as since_step to get only newer entries.
+    """
+    job = await db.get(TrainingJob, job_id, options=[raiseload("*")])
+    if not job:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    
+    statement = _TRAINING_LOGS_FOR_JOB
+    if since_step is not None:
+        statement = statement.where(TrainingLog.step > since_step)
+    
+    async def log_lines() -> AsyncIterator[bytes]:
+        # The request's session may be closed before the body is sent, so the
+        # stream reads through its own
+        async with SessionLocal() as stream_db:
+            logs = await stream_db.stream_scalars(statement, {"job_id": job_id})
+            async for batch in logs.partitions():
+                yield b"".join(
+                    orjson.dumps(TrainingLogSchema.model_validate(log).model_dump()) + b"\n"
+                    for log in batch
+                )
+    
+    return StreamingResponse(log_lines(), media_type="application/x-ndjson")
 
 
 @router.delete("/{job_id}", status_code=204)
-def cancel_training_job(job_id: int, db: Session = Depends(get_db)):
-    """Cancel a training job."""
-    job = db.query(TrainingJob).filter(TrainingJob.id == job_id).first()
+async def cancel_training_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Cancel a training job; answers 202 if training is still stopping after the timeout."""
+    job = await db.get(TrainingJob, job_id, options=[raiseload("*")])
     if not job:
         raise HTTPException(status_code=404, detail="Training job not found")
     
     if job.status in ["completed", "failed"]:
         raise HTTPException(status_code=400, detail="Cannot cancel completed or failed job")
     
-    # Cancel task if running
-    if job_id in _active_training_tasks:
-        task = _active_training_tasks[job_id]
+    task = await task_registry.cancel(job_id)
+    if task is None:
+        # Never launched (or lost with a previous process), so nothing else writes the row
+        job.status = "failed"
+        job.error_message = "Cancelled by user"
+        job.completed_at = datetime.now()
+        await db.commit()
+        return None
+    
+    if job.status == "queued":
+        # Still waiting for a slot, so there is no training loop to stop
         task.cancel()
-        del _active_training_tasks[job_id]
     
-    job.status = "failed"
-    job.error_message = "Cancelled by user"
-    job.completed_at = datetime.now()
-    db.commit()
+    # The task records the final status. A running trainer is never cancelled
+    # outright: its thread would keep the GPU while the next queued job started.
+    done, _ = await asyncio.wait({task}, timeout=CANCEL_TIMEOUT_SECONDS)
+    if not done:
+        return Response(status_code=202)
     
     return None
 
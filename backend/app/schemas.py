@@ -1,7 +1,7 @@
 """Pydantic schemas for API request/response validation."""
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 # Dataset Schemas
@@ -18,8 +18,7 @@ class DatasetResponse(BaseModel):
     validation_report: Optional[Dict[str, Any]]
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ValidationReport(BaseModel):
@@ -38,6 +37,7 @@ class TrainingConfig(BaseModel):
     batch_size: int = 4
     learning_rate: float = 2e-4
     max_seq_length: int = 512
+    gradient_accumulation_steps: int = 1
     lora_r: int = 8
     lora_alpha: int = 16
     lora_dropout: float = 0.05
@@ -51,7 +51,16 @@ class TrainingJobCreate(BaseModel):
 class TrainingLog(BaseModel):
     step: int
     loss: float
-    timestamp: datetime
+    epoch: float
+    ts_ns: int = Field(exclude=True)
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def timestamp(self) -> datetime:
+        # Stored as epoch nanoseconds; only formatted when a response is built
+        return datetime.fromtimestamp(self.ts_ns / 1e9, tz=timezone.utc)
 
 
 class TrainingJobResponse(BaseModel):
@@ -60,13 +69,12 @@ class TrainingJobResponse(BaseModel):
     status: str
     config: Optional[Dict[str, Any]]
     model_path: Optional[str]
-    training_logs: Optional[List[Dict[str, Any]]]
     started_at: Optional[datetime]
     completed_at: Optional[datetime]
     error_message: Optional[str]
 
-    class Config:
-        from_attributes = True
+    # model_path is a column name, not a pydantic "model_" attribute
+    model_config = ConfigDict(from_attributes=True, protected_namespaces=())
 
 
 # Evaluation Schemas
@@ -76,27 +84,40 @@ class TestExample(BaseModel):
     finetuned_output: str
     base_latency_ms: int
     finetuned_latency_ms: int
+    base_tokens: Optional[int] = None
+    finetuned_tokens: Optional[int] = None
+
+    model_config = ConfigDict(from_attributes=True)
 
 
 class EvaluationMetrics(BaseModel):
-    base_model: Dict[str, Any]
-    finetuned_model: Dict[str, Any]
+    # Empty until the evaluation finishes
+    base_model: Dict[str, Any] = Field(default_factory=dict)
+    finetuned_model: Dict[str, Any] = Field(default_factory=dict)
+    improvements: Dict[str, Any] = Field(default_factory=dict)
 
 
 class EvaluationCreate(BaseModel):
     training_job_id: int
     test_size: int = 50
+    quantization: str = Field("none", pattern="^(none|int8|nf4)$")
 
 
 class EvaluationResponse(BaseModel):
     id: int
     training_job_id: int
-    test_results: List[TestExample]
-    metrics: EvaluationMetrics
+    test_results: List[TestExample] = Field(default_factory=list)
+    metrics: EvaluationMetrics = Field(default_factory=EvaluationMetrics)
+    status: Optional[str]
     created_at: datetime
+    completed_at: Optional[datetime]
+    error_message: Optional[str] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Build the nested validators once at import rather than on first request
+EvaluationResponse.model_rebuild()
 
 
 # Inference Schemas
@@ -105,6 +126,8 @@ class InferenceRequest(BaseModel):
     prompt: str = Field(..., min_length=1)
     max_tokens: int = Field(256, ge=1, le=2048)
 
+    model_config = ConfigDict(protected_namespaces=())
+
 
 class InferenceResponse(BaseModel):
     output: str
@@ -126,6 +149,5 @@ class UserRatingResponse(BaseModel):
     preferred_model: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
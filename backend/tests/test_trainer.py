@@ -0,0 +1,43 @@
+"""Tests for packing training examples into fixed-length blocks."""
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+pytest.importorskip("datasets")
+
+from app.ml.trainer import tokenize_function
+
+EOS = 0
+PAD = 1
+
+
+class FakeTokenizer:
+    """Tokenizer mapping each character to its code point."""
+    eos_token_id = EOS
+    pad_token_id = PAD
+    
+    def __call__(self, texts):
+        return {"input_ids": [[ord(char) for char in text] for text in texts]}
+
+
+def test_packed_labels_at_example_boundaries():
+    examples = {"prompt": ["ab", "cd"], "completion": ["c", "e"]}
+    
+    packed = tokenize_function(examples, FakeTokenizer(), max_length=10)
+    
+    a, b, c, d, e = (ord(char) for char in "abcde")
+    assert packed["input_ids"] == [[a, b, c, EOS, c, d, e, EOS, PAD, PAD]]
+    # EOS labels are kept; the token predicted from an EOS is masked, as is padding
+    assert packed["labels"] == [[a, b, c, EOS, -100, d, e, EOS, -100, -100]]
+    assert packed["attention_mask"] == [[1, 1, 1, 1, 1, 1, 1, 1, 0, 0]]
+
+
+def test_packed_labels_across_block_boundary():
+    examples = {"prompt": ["ab", "cd"], "completion": ["", ""]}
+    
+    packed = tokenize_function(examples, FakeTokenizer(), max_length=4)
+    
+    a, b, c, d = (ord(char) for char in "abcd")
+    assert packed["input_ids"] == [[a, b, EOS, c], [d, EOS, PAD, PAD]]
+    assert packed["labels"] == [[a, b, EOS, -100], [d, EOS, -100, -100]]
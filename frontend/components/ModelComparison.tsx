@@ -37,7 +37,10 @@ interface Evaluation {
   training_job_id: number
   test_results: TestExample[]
   metrics: Metrics
+  status: 'queued' | 'running' | 'completed' | 'failed' | null
   created_at: string
+  completed_at: string | null
+  error_message: string | null
 }
 
 interface ModelComparisonProps {
@@ -50,11 +53,14 @@ export default function ModelComparison({ evaluationId }: ModelComparisonProps)
   const [loading, setLoading] = useState(true)
   const [rating, setRating] = useState<{ [key: number]: 'base' | 'finetuned' }>({})
 
+  const finished = evaluation?.status === 'completed' || evaluation?.status === 'failed'
+
   useEffect(() => {
+    if (finished) return
     fetchEvaluation()
-    const interval = setInterval(fetchEvaluation, 5000) // Poll for updates
+    const interval = setInterval(fetchEvaluation, 5000) // Poll until the evaluation finishes
     return () => clearInterval(interval)
-  }, [evaluationId])
+  }, [evaluationId, finished])
 
   const fetchEvaluation = async () => {
     try {
@@ -86,6 +92,14 @@ export default function ModelComparison({ evaluationId }: ModelComparisonProps)
     return <div className="text-center py-8">Loading evaluation...</div>
   }
 
+  if (evaluation?.status === 'failed') {
+    return (
+      <div className="text-center py-8">
+        <p className="text-red-600">Evaluation failed: {evaluation.error_message}</p>
+      </div>
+    )
+  }
+
   if (!evaluation || !evaluation.test_results || evaluation.test_results.length === 0) {
     return (
       <div className="text-center py-8">
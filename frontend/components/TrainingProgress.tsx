@@ -1,18 +1,24 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import axios from 'axios'
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts'
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
+interface TrainingLog {
+  step: number
+  loss: number
+  epoch: number
+  timestamp: string
+}
+
 interface TrainingJob {
   id: number
   dataset_id: number
   status: string
   config: any
   model_path: string | null
-  training_logs: Array<{ step: number; loss: number; epoch: number; timestamp: string }> | null
   started_at: string | null
   completed_at: string | null
   error_message: string | null
@@ -24,17 +30,43 @@ interface TrainingProgressProps {
 
 export default function TrainingProgress({ jobId }: TrainingProgressProps) {
   const [job, setJob] = useState<TrainingJob | null>(null)
+  const [logs, setLogs] = useState<TrainingLog[]>([])
   const [loading, setLoading] = useState(true)
+  // Last step received, so each poll only downloads newer log entries
+  const lastStep = useRef<number | null>(null)
+
+  const finished = job?.status === 'completed' || job?.status === 'failed'
 
   useEffect(() => {
+    setJob(null)
+    setLogs([])
+    lastStep.current = null
+  }, [jobId])
+
+  useEffect(() => {
+    if (finished) return
     fetchJob()
-    const interval = setInterval(fetchJob, 2000) // Poll every 2 seconds
+    const interval = setInterval(fetchJob, 2000) // Poll every 2 seconds until the job finishes
     return () => clearInterval(interval)
-  }, [jobId])
+  }, [jobId, finished])
 
   const fetchJob = async () => {
     try {
       const response = await axios.get(`${API_URL}/api/training/${jobId}`)
+      // Logs are written before the final status, so fetching them after the job
+      // means a finished job's last poll has every entry
+      const logsResponse = await axios.get(`${API_URL}/api/training/${jobId}/logs`, {
+        params: lastStep.current === null ? {} : { since_step: lastStep.current },
+        responseType: 'text', // NDJSON, one entry per line
+      })
+      const newLogs: TrainingLog[] = (logsResponse.data as string)
+        .split('\n')
+        .filter(line => line)
+        .map(line => JSON.parse(line))
+      if (newLogs.length > 0) {
+        lastStep.current = newLogs[newLogs.length - 1].step
+        setLogs(previous => [...previous, ...newLogs])
+      }
       setJob(response.data)
     } catch (error) {
       console.error('Error fetching training job:', error)
@@ -51,7 +83,6 @@ export default function TrainingProgress({ jobId }: TrainingProgressProps) {
     return <div className="text-center py-8 text-red-600">Training job not found</div>
   }
 
-  const logs = job.training_logs || []
   const chartData = logs.map(log => ({
     step: log.step,
     loss: log.loss,